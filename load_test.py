@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""
+Non-interactive load generator for the My Meal Planner backend.
+
+Drives /health and /plan (or any other endpoint given with --target) either
+with a fixed number of concurrent workers (closed loop) or at a fixed
+arrival rate (open loop), then reports latency percentiles, time to first
+byte, throughput and error rates per endpoint.
+
+Start the server with the stubbed model to measure the web tier alone:
+    MEALPLANNER_STUB_MODEL=1 GOOGLE_CLOUD_PROJECT=local python main.py
+    python load_test.py --scenario mixed --concurrency 8 --duration 30
+"""
+import argparse
+import json
+import math
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+API_URL = "http://localhost:8080"
+DEFAULT_PROMPT = "Create a 2-day meal plan with simple recipes."
+
+
+class Target:
+    """One endpoint to drive, with its share of the traffic."""
+
+    def __init__(self, name, method, path, payload=None, weight=1.0):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.payload = payload
+        self.weight = weight
+
+
+class Result:
+    """Timing and outcome of a single request."""
+
+    def __init__(self, target, ok, status, latency, ttfb, queued=0.0, error=None):
+        self.target = target
+        self.ok = ok
+        self.status = status
+        self.latency = latency
+        self.ttfb = ttfb
+        self.queued = queued
+        self.error = error
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not values:
+        return 0.0
+    rank = max(math.ceil(pct / 100.0 * len(values)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def build_targets(args):
+    """Translate the command line into the list of targets to drive."""
+    health = Target("health", "GET", "/health")
+    plan = Target("plan", "POST", "/plan", payload={"prompt": args.prompt})
+
+    if args.target:
+        targets = []
+        for spec in args.target:
+            # METHOD:PATH[:WEIGHT], e.g. POST:/plan/stream:0.5
+            parts = spec.split(":")
+            if len(parts) not in (2, 3):
+                raise ValueError(f"Invalid --target '{spec}', expected METHOD:PATH[:WEIGHT]")
+            method, path = parts[0].upper(), parts[1]
+            weight = float(parts[2]) if len(parts) == 3 else 1.0
+            payload = {"prompt": args.prompt} if method == "POST" else None
+            targets.append(Target(f"{method} {path}", method, path, payload, weight))
+        return targets
+
+    if args.scenario == "health":
+        return [health]
+    if args.scenario == "plan":
+        return [plan]
+
+    # mixed: --plan-ratio of the requests go to /plan, the rest to /health
+    plan.weight = args.plan_ratio
+    health.weight = 1.0 - args.plan_ratio
+    return [t for t in (health, plan) if t.weight > 0]
+
+
+class LoadGenerator:
+    """Sends requests to the targets and collects the results."""
+
+    def __init__(self, base_url, targets, timeout, clients=0):
+        self.base_url = base_url.rstrip("/")
+        self.targets = targets
+        self.clients = clients
+        self.weights = [t.weight for t in targets]
+        self.timeout = timeout
+        self.results = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _session(self):
+        # One connection pool per worker thread, like a real keep-alive client
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def pick_target(self):
+        if len(self.targets) == 1:
+            return self.targets[0]
+        return random.choices(self.targets, weights=self.weights)[0]
+
+    def send(self, target, scheduled_at=None):
+        """Send one request and record its timing."""
+        start = time.perf_counter()
+        queued = start - scheduled_at if scheduled_at is not None else 0.0
+        ttfb = None
+        payload = target.payload
+        if payload is not None and self.clients:
+            # Spread requests over simulated browsers so per-client memory is exercised
+            payload = dict(payload, client_id=f"loadtest{random.randrange(self.clients):04d}")
+        try:
+            response = self._session().request(
+                target.method,
+                f"{self.base_url}{target.path}",
+                json=payload,
+                timeout=self.timeout,
+                stream=True,
+            )
+            headers_at = time.perf_counter()
+            # Read the body chunk by chunk so streaming endpoints report
+            # time to the first body byte rather than to the headers.
+            for chunk in response.iter_content(chunk_size=None):
+                if chunk and ttfb is None:
+                    ttfb = time.perf_counter() - start
+            response.close()
+            if ttfb is None:
+                ttfb = headers_at - start
+            end = time.perf_counter()
+            ok = 200 <= response.status_code < 300
+            result = Result(target, ok, response.status_code, end - start + queued,
+                            ttfb + queued, queued)
+        except requests.exceptions.Timeout:
+            result = Result(target, False, "timeout", time.perf_counter() - start + queued,
+                            ttfb or 0.0, queued, "timeout")
+        except requests.exceptions.RequestException as e:
+            result = Result(target, False, "connection", time.perf_counter() - start + queued,
+                            ttfb or 0.0, queued, type(e).__name__)
+
+        with self._lock:
+            self.results.append(result)
+        return result
+
+    def run_closed_loop(self, concurrency, total_requests, duration):
+        """Keep `concurrency` requests in flight until the budget is spent."""
+        deadline = time.perf_counter() + duration if duration else None
+        remaining = [total_requests]
+        budget_lock = threading.Lock()
+
+        def worker():
+            while True:
+                if deadline is not None and time.perf_counter() >= deadline:
+                    return
+                if deadline is None:
+                    with budget_lock:
+                        if remaining[0] <= 0:
+                            return
+                        remaining[0] -= 1
+                self.send(self.pick_target())
+
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def run_open_loop(self, rate, concurrency, total_requests, duration, poisson):
+        """Issue requests at `rate` per second regardless of how fast they finish.
+
+        Latency is measured from the scheduled send time, so requests that
+        wait for a free worker are charged for the wait (no coordinated
+        omission).
+        """
+        if duration:
+            total_requests = int(rate * duration)
+        start = time.perf_counter()
+        next_at = start
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for _ in range(total_requests):
+                delay = next_at - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(self.send, self.pick_target(), next_at)
+                gap = random.expovariate(rate) if poisson else 1.0 / rate
+                next_at += gap
+
+
+def summarize(results, elapsed):
+    """Aggregate results per target (plus an overall row)."""
+    groups = defaultdict(list)
+    for result in results:
+        groups[result.target.name].append(result)
+    if len(groups) > 1:
+        groups["ALL"] = list(results)
+
+    summary = {}
+    for name, group in groups.items():
+        latencies = sorted(r.latency for r in group if r.ok)
+        ttfbs = sorted(r.ttfb for r in group if r.ok)
+        errors = defaultdict(int)
+        for r in group:
+            if not r.ok:
+                errors[str(r.status)] += 1
+        successes = len(latencies)
+        summary[name] = {
+            "requests": len(group),
+            "successes": successes,
+            "errors": dict(errors),
+            "error_rate": (len(group) - successes) / len(group) if group else 0.0,
+            "throughput_rps": successes / elapsed if elapsed > 0 else 0.0,
+            "latency_ms": {
+                "p50": percentile(latencies, 50) * 1000,
+                "p95": percentile(latencies, 95) * 1000,
+                "p99": percentile(latencies, 99) * 1000,
+                "max": (latencies[-1] if latencies else 0.0) * 1000,
+                "mean": (sum(latencies) / successes if successes else 0.0) * 1000,
+            },
+            "ttfb_ms": {
+                "p50": percentile(ttfbs, 50) * 1000,
+                "p95": percentile(ttfbs, 95) * 1000,
+                "p99": percentile(ttfbs, 99) * 1000,
+            },
+            "max_queued_ms": max((r.queued for r in group), default=0.0) * 1000,
+        }
+    return summary
+
+
+def print_summary(summary, elapsed, args):
+    mode = f"rate={args.rate}/s" if args.rate else f"concurrency={args.concurrency}"
+    print(f"\n📊 Results ({mode}, {elapsed:.1f}s elapsed)")
+    print("=" * 96)
+    header = (f"{'target':<16}{'reqs':>7}{'err%':>7}{'rps':>8}"
+              f"{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}"
+              f"{'ttfb50':>9}{'ttfb99':>9}")
+    print(header)
+    print("-" * 96)
+    for name, stats in summary.items():
+        lat = stats["latency_ms"]
+        ttfb = stats["ttfb_ms"]
+        print(f"{name:<16}{stats['requests']:>7}{stats['error_rate'] * 100:>6.1f}%"
+              f"{stats['throughput_rps']:>8.1f}"
+              f"{lat['p50']:>9.1f}{lat['p95']:>9.1f}{lat['p99']:>9.1f}{lat['max']:>9.1f}"
+              f"{ttfb['p50']:>9.1f}{ttfb['p99']:>9.1f}")
+    print("-" * 96)
+    print("Latencies in milliseconds, percentiles over successful requests.")
+    for name, stats in summary.items():
+        if stats["errors"] and name != "ALL":
+            print(f"❌ {name} errors: {stats['errors']}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the My Meal Planner backend.")
+    parser.add_argument("--url", default=API_URL, help="Base URL of the server")
+    parser.add_argument("--scenario", choices=["health", "plan", "mixed"], default="health",
+                        help="Which endpoints to drive (ignored when --target is given)")
+    parser.add_argument("--target", action="append",
+                        help="Custom endpoint as METHOD:PATH[:WEIGHT]; repeatable")
+    parser.add_argument("--plan-ratio", type=float, default=0.2,
+                        help="Share of /plan requests in the mixed scenario")
+    parser.add_argument("--prompt", default=DEFAULT_PROMPT, help="Prompt sent to POST targets")
+    parser.add_argument("--clients", type=int, default=0,
+                        help="Send POST requests as this many distinct client ids (0: anonymous)")
+    parser.add_argument("--concurrency", type=int, default=4,
+                        help="Concurrent workers (closed loop) or max in flight (open loop)")
+    parser.add_argument("--rate", type=float,
+                        help="Arrival rate in requests/second; switches to open loop")
+    parser.add_argument("--poisson", action="store_true",
+                        help="Use exponential inter-arrival times with --rate")
+    parser.add_argument("--requests", type=int, default=100,
+                        help="Total requests to send when --duration is not set")
+    parser.add_argument("--duration", type=float, help="Run for this many seconds")
+    parser.add_argument("--warmup", type=int, default=0,
+                        help="Requests to send first and leave out of the results")
+    parser.add_argument("--timeout", type=float, default=300, help="Per-request timeout in seconds")
+    parser.add_argument("--json-out", help="Also write the summary to this JSON file")
+    args = parser.parse_args(argv)
+
+    if not 0.0 <= args.plan_ratio <= 1.0:
+        parser.error("--plan-ratio must be between 0 and 1")
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+    if args.rate is not None and args.rate <= 0:
+        parser.error("--rate must be positive")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        targets = build_targets(args)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return 2
+
+    generator = LoadGenerator(args.url, targets, args.timeout, args.clients)
+
+    if args.warmup:
+        print(f"🔥 Warming up with {args.warmup} requests...")
+        for _ in range(args.warmup):
+            generator.send(generator.pick_target())
+        generator.results = []
+
+    print(f"🧪 Load testing {args.url} -> {', '.join(t.name for t in targets)}")
+    start = time.perf_counter()
+    if args.rate:
+        generator.run_open_loop(args.rate, args.concurrency, args.requests,
+                                args.duration, args.poisson)
+    else:
+        generator.run_closed_loop(args.concurrency, args.requests, args.duration)
+    elapsed = time.perf_counter() - start
+
+    if not generator.results:
+        print("❌ No requests were sent.")
+        return 1
+
+    summary = summarize(generator.results, elapsed)
+    print_summary(summary, elapsed, args)
+
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump({"elapsed_s": elapsed, "args": vars(args), "targets": summary}, f, indent=2)
+        print(f"📝 Summary written to {args.json_out}")
+
+    # Non-zero exit when every request failed, so CI can catch a dead server
+    all_stats = summary.get("ALL") or next(iter(summary.values()))
+    return 1 if all_stats["successes"] == 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
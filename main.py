@@ -2,14 +2,28 @@
 Google Cloud Functions entry point for My Meal Planner API.
 This can be deployed to Cloud Run or Cloud Functions.
 """
-import json
+import logging
 import os
 import asyncio
-from flask import Flask, request, jsonify, send_from_directory, render_template
+import time
+import uuid
+from flask import Flask, request, jsonify, send_from_directory, render_template, g
 import vertexai
 import re
 from datetime import datetime, timedelta
 
+from mymealplanner.request_logging import (
+    begin_request,
+    current_trace_id,
+    end_request,
+    log_payload,
+    setup_logging,
+)
+
+# Start the background log writer before anything else logs
+setup_logging()
+logger = logging.getLogger("mymealplanner.api")
+
 # Initialize Vertex AI FIRST, before importing agents
 # This ensures models have the correct configuration
 project = os.environ.get("GOOGLE_CLOUD_PROJECT")
@@ -28,13 +42,14 @@ vertexai.init(
 )
 
 # Now import ADK components and agents (they will use the initialized Vertex AI)
-from google.adk.memory import InMemoryMemoryService
-from google.adk.sessions import InMemorySessionService
 from google.adk.runners import Runner
 from mymealplanner.agent import root_agent
 
 from mymealplanner.agent_utils import run_session
+from mymealplanner.diversity import ANONYMOUS_USER_PREFIX
 from mymealplanner.parsing import parse_summary_to_structured_data
+from mymealplanner.state import create_state_services
+from mymealplanner.stub_model import stub_model_enabled
 
 
 app = Flask(__name__,
@@ -45,6 +60,37 @@ app = Flask(__name__,
 
 CORS_ALLOWED_ORIGIN = os.environ.get('CORS_ALLOWED_ORIGIN', 'https://derrickauyoung.github.io')
 
+# Anonymous per-browser id sent by the frontend (see static/js/app.js)
+CLIENT_ID_PATTERN = re.compile(r'[A-Za-z0-9_-]{8,64}')
+
+
+@app.before_request
+def start_request_log():
+    g.trace_id, g.log_token = begin_request(request.headers)
+    g.request_start = time.perf_counter()
+
+
+@app.teardown_request
+def end_request_log(exc):
+    end_request(g.pop('log_token', None))
+
+
+@app.after_request
+def finish_request_log(response):
+    response.headers['X-Request-ID'] = g.get('trace_id', '')
+    duration_ms = (time.perf_counter() - g.get('request_start', time.perf_counter())) * 1000
+    # Health checks are frequent and uninteresting unless debugging
+    level = logging.DEBUG if request.path == '/health' else logging.INFO
+    logger.log(level, "%s %s %s", request.method, request.path, response.status_code, extra={
+        "fields": {
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "duration_ms": round(duration_ms, 1),
+        }
+    })
+    return response
+
 
 @app.after_request
 def add_cors_headers(response):
@@ -54,6 +100,7 @@ def add_cors_headers(response):
     response.headers['Access-Control-Allow-Methods'] = 'GET,POST,OPTIONS'
     response.headers['Access-Control-Allow-Headers'] = 'Content-Type,Authorization'
     response.headers['Access-Control-Allow-Credentials'] = 'true'
+    response.headers['Access-Control-Expose-Headers'] = 'X-Request-ID'
     return response
 
 
@@ -111,6 +158,16 @@ def plan_meals():
         
         if not prompt:
             return jsonify({"error": "Prompt is required"}), 400
+
+        # Memory and recipe history are kept per client. Requests without a
+        # usable client id get a throwaway user id, so they neither see nor
+        # leave anything for other requests.
+        client_id = str(data.get('client_id') or request.headers.get('X-Client-ID') or '')
+        if CLIENT_ID_PATTERN.fullmatch(client_id):
+            user_id = f"client_{client_id}"
+        else:
+            client_id = ''
+            user_id = f"{ANONYMOUS_USER_PREFIX}{uuid.uuid4().hex}"
         
         # Ensure Vertex AI is properly initialized
         # Re-initialize to make sure it's set up correctly
@@ -126,12 +183,12 @@ def plan_meals():
         try:
             vertexai.init(project=project, location=location)
         except Exception as e:
-            print(f"Warning: Vertex AI already initialized: {e}")
+            logger.warning("Vertex AI already initialized: %s", e)
         
         # Create runner with session and memory services
         # The Runner will use the agents' configured models (which are set to use Vertex AI)
-        session_service = InMemorySessionService()
-        memory_service = InMemoryMemoryService()
+        # With MEALPLANNER_STATE_DB set these are shared by all gunicorn workers
+        session_service, memory_service = create_state_services(shared_memory=bool(client_id))
         
         auto_runner = Runner(
             agent=root_agent,
@@ -139,9 +196,16 @@ def plan_meals():
             session_service=session_service,
             memory_service=memory_service,
         )
-        print("Auto runner created.")
-        print(f"Using Vertex AI with project: {project}, location: {location}")
+        if stub_model_enabled():
+            logger.debug("Auto runner created, using stubbed model (MEALPLANNER_STUB_MODEL is set)")
+        else:
+            logger.debug("Auto runner created, using Vertex AI with project: %s, location: %s",
+                         project, location)
         
+        # Unique per request: with a shared session store, reusing an id would
+        # resume another request's conversation
+        session_id = f"session_{uuid.uuid4().hex}"
+
         # Run the agent asynchronously and get the response
         # Use asyncio.run() to execute the async function from sync context
         # Get or create a new event loop for this request
@@ -162,13 +226,13 @@ def plan_meals():
                     session_service,
                     prompt,
                     app_name="agents",
-                    user_id="api_user",
-                    session_id=f"session_{hash(prompt) % 10000}"
+                    user_id=user_id,
+                    session_id=session_id
                 )
             )
         except Exception as e:
             # If there's an error, try with a fresh event loop
-            print(f"Error with current loop, creating fresh one: {e}")
+            logger.warning("Error with current loop, creating fresh one: %s", e)
             loop = asyncio.new_event_loop()
             asyncio.set_event_loop(loop)
             final_summary = loop.run_until_complete(
@@ -177,8 +241,8 @@ def plan_meals():
                     session_service,
                     prompt,
                     app_name="agents",
-                    user_id="api_user",
-                    session_id=f"session_{hash(prompt) % 10000}"
+                    user_id=user_id,
+                    session_id=session_id
                 )
             )
         
@@ -195,21 +259,24 @@ def plan_meals():
                     if session_summary:
                         final_summary = session_summary
         except Exception as e:
-            print(f"Note: Could not access session state: {e}")
+            logger.debug("Could not access session state: %s", e)
+
+        # The session is not needed once the summary is out of it. With the
+        # shared store it would otherwise stay in the database.
+        try:
+            loop.run_until_complete(session_service.delete_session(
+                app_name="agents", user_id=user_id, session_id=session_id
+            ))
+        except Exception as e:
+            logger.warning("Could not delete session %s: %s", session_id, e)
         
         # Right after getting final_summary
-        print("=" * 80)
-        print("RAW SUMMARY OUTPUT:")
-        print(final_summary)
-        print("=" * 80)
+        log_payload(logger, "Raw summary output", final_summary, session_id=session_id)
 
         # Parse the summary into structured data
         structured_data = parse_summary_to_structured_data(final_summary)
 
-        print("=" * 80)
-        print("PARSED STRUCTURED DATA:")
-        print(json.dumps(structured_data, indent=2))
-        print("=" * 80)
+        log_payload(logger, "Parsed structured data", structured_data, session_id=session_id)
         
         # Clean up - InMemoryRunner manages sessions internally
         # Sessions are automatically cleaned up when the runner goes out of scope
@@ -221,12 +288,12 @@ def plan_meals():
         }), 200
         
     except Exception as e:
-        import traceback
-        error_details = traceback.format_exc()
-        print(f"Error in plan_meals: {error_details}")
+        # Full traceback goes to the logs only; the client gets the trace id
+        # to quote when reporting the problem
+        logger.exception("Error in plan_meals")
         return jsonify({
             "error": str(e),
-            "details": error_details
+            "trace_id": current_trace_id()
         }), 500
 
 
@@ -18,11 +18,28 @@ else:
     project = os.environ.get("GOOGLE_CLOUD_PROJECT", "")
     location = os.environ.get("GOOGLE_CLOUD_LOCATION", "us-central1")
 
+import json
+import logging
 from google.adk.agents import Agent, SequentialAgent
-from google.adk.tools import preload_memory
 from google.adk.tools import google_search
 from google.genai import types, Client
 from google.adk.models.google_llm import Gemini
+from mymealplanner.stub_model import (
+    STUB_RECIPES,
+    STUB_SUMMARY,
+    StubLlm,
+    stub_model_enabled,
+)
+from mymealplanner.diversity import (
+    ANONYMOUS_USER_PREFIX,
+    exclusion_list,
+    filter_near_duplicates,
+    get_recipe_history,
+    meals_needed,
+    parse_recipes,
+)
+
+logger = logging.getLogger(__name__)
 
 
 # Create configured client
@@ -48,6 +65,16 @@ retry_config = types.HttpRetryOptions(
 )
 
 
+def create_model(stub_response: str):
+    """Gemini model for an agent, or a canned stub when MEALPLANNER_STUB_MODEL is set."""
+    if stub_model_enabled():
+        return StubLlm(model="stub-gemini-2.5-flash-lite", response_text=stub_response)
+    return ConfiguredGemini(
+        model="gemini-2.5-flash-lite",
+        retry_options=retry_config,
+    )
+
+
 async def auto_save_to_memory(callback_context):
     """Automatically save session to memory after each agent turn."""
     await callback_context._invocation_context.memory_service.add_session_to_memory(
@@ -55,13 +82,60 @@ async def auto_save_to_memory(callback_context):
     )
 
 
+def _has_history(session) -> bool:
+    """Anonymous users get a new id per request, so they have no history to keep."""
+    return not session.user_id.startswith(ANONYMOUS_USER_PREFIX)
+
+
+def _prompt_text(callback_context) -> str:
+    content = callback_context.user_content
+    if not content or not content.parts:
+        return ""
+    return " ".join(part.text for part in content.parts if part.text)
+
+
+async def provide_recipe_exclusions(callback_context):
+    """Put the user's recent recipe titles in state for the search instruction."""
+    session = callback_context.session
+    history = []
+    if _has_history(session):
+        history = await get_recipe_history().recent(session.app_name, session.user_id)
+    callback_context.state["recent_recipes"] = exclusion_list(history)
+
+
+async def dedupe_recipes(callback_context):
+    """Drop near-duplicate and spare recipes before they reach the summarizer.
+
+    Only the recipes passed on to the summarizer are recorded in the history.
+    """
+    recipes = parse_recipes(callback_context.state.get("recipes"))
+    if not recipes:
+        # Leave unparseable output for the summarizer to make sense of
+        return
+
+    session = callback_context.session
+    history_store = get_recipe_history()
+    history = []
+    if _has_history(session):
+        history = await history_store.recent(session.app_name, session.user_id)
+    kept, fingerprints, dropped = filter_near_duplicates(
+        recipes, history, needed=meals_needed(_prompt_text(callback_context))
+    )
+
+    if dropped:
+        logger.info("Dropped near-duplicate and spare recipes", extra={"fields": {
+            "kept": len(kept),
+            "dropped": dropped,
+        }})
+    callback_context.state["recipes"] = json.dumps(kept, ensure_ascii=False)
+    if _has_history(session):
+        await history_store.add(session.app_name, session.user_id, fingerprints)
+
+
 # Recipe Search Agent: Its job is to use the google_search tool and present findings.
 recipe_search_agent = Agent(
     name="RecipeSearchAgent",
-    model=ConfiguredGemini(
-        model="gemini-2.5-flash-lite",
-        retry_options=retry_config,
-    ),
+    model=create_model(STUB_RECIPES),
     instruction="""You are a specialized recipe search agent focused on finding DIVERSE recipes.
 
 SEARCH STRATEGY FOR VARIETY:
@@ -79,7 +153,7 @@ SEARCH STRATEGY FOR VARIETY:
    - "site:budgetbytes.com lunch recipe"
    - "site:foodnetwork.com dinner recipe"
 
-3. Make sure there are no duplicates!
+3. Do not repeat these recently planned recipes (or close variations of them): {recent_recipes}
 
 4. Vary cuisine styles: American, Asian, Mediterranean, Mexican, etc.
 
@@ -103,7 +177,7 @@ SEARCH STRATEGY FOR VARIETY:
     }
 ]
 
-7. Only include recipes that are not already in the memory and are not already in the list of recipes.
+7. Only include recipes that are not already in the list of recipes. Find 3 more recipes than the meal plan needs, so any repeats can be left out.
 
 8. Do not include empty or invalid recipes.
 
@@ -112,11 +186,12 @@ SEARCH STRATEGY FOR VARIETY:
 10. Do not accept "(as needed)", "(quantity)", "(quantity not specified)", or similar for ingredient quantities.
 
 Focus on getting diverse, interesting recipe titles from various sources.""",
-    tools=[
+    # google_search is a Gemini built-in tool and is rejected for other models
+    tools=[] if stub_model_enabled() else [
         google_search,
-        preload_memory,
     ],
-    after_agent_callback=auto_save_to_memory,  # Saves after each turn!
+    before_agent_callback=provide_recipe_exclusions,
+    after_agent_callback=[dedupe_recipes, auto_save_to_memory],  # Saves after each turn!
     output_key="recipes", # The result of this agent will be stored in the session state with this key.
 )
 
@@ -125,10 +200,7 @@ print("✅ recipe_search_agent created.")
 # Meal Plan Summarizer Agent: Its job is to summarize the text it receives.
 summarizer_agent = Agent(
     name="SummarizerAgent",
-    model=ConfiguredGemini(
-        model="gemini-2.5-flash-lite",
-        retry_options=retry_config,
-    ),
+    model=create_model(STUB_SUMMARY),
     # The instruction is modified to generate a google sheet with recipe and ingredients information.
     instruction="""Read the provided recipe findings: {recipes}
 
@@ -178,7 +250,8 @@ DAY #2:
 - [Recipe Title 1](https://www.google.com/search?q=Recipe+Title+1+recipe)
 
 Make sure ALL recipe titles are clickable Google search links.""",
-    tools=[preload_memory],
+    # No preload_memory: the summarizer works only from the filtered {recipes},
+    # so earlier plans and dropped near-duplicates never reach it
     output_key="final_summary",
 )
 
@@ -2,9 +2,13 @@
 Utility functions for running sessions and returning the final response.
 """
 import asyncio
+import logging
 from google.adk.runners import Runner
 from google.adk.sessions import InMemorySessionService
 from google.genai import types
+from mymealplanner.request_logging import log_payload
+
+logger = logging.getLogger(__name__)
 
 async def run_session(
     runner_instance: Runner,
@@ -27,7 +31,7 @@ async def run_session(
     Returns:
         The final response text.
     """
-    print(f"\n### Session: {session_id}")
+    logger.info("Session started", extra={"fields": {"session_id": session_id}})
 
     try:
         # Create or retrieve session
@@ -57,12 +61,13 @@ async def run_session(
                 text = event.content.parts[0].text
                 if text and text != "None":
                     final_response_text = text
-                    print(f"Model: > {text}")
+                    log_payload(logger, "Model final response", text,
+                                session_id=session_id, author=event.author)
         
         return final_response_text if final_response_text else "No response generated"
         
     except Exception as e:
-        print(f"Error in run_session: {e}")
+        logger.error("Error in run_session: %s", e)
         raise
     finally:
         # Give asyncio time to clean up connections
@@ -0,0 +1,376 @@
+"""
+Local recipe de-duplication and diversity across meal plans.
+
+Each recipe is fingerprinted by the word shingles of its normalized title and
+the set of its normalized ingredient names. Two recipes are near-duplicates
+when their title shingles overlap strongly ("Easy Chickpea Salad" vs
+"Mediterranean Chickpea Salad"), or when their titles partly overlap and they
+share most of their ingredients.
+
+The search agent's results are filtered against each other and against the
+user's recent recipes before summarization, and a compact list of recent
+recipes is handed to the search step so the model can steer away from them
+without loading the whole memory. The search agent is asked for a few spare
+recipes, and repeats from history are only dropped while enough recipes
+remain to fill the plan.
+
+History is kept per (app_name, user_id): in process memory by default, or in
+the shared SQLite state database when MEALPLANNER_STATE_DB is set, where it
+expires after RECIPE_HISTORY_TTL_SECONDS. Anonymous
+users (ANONYMOUS_USER_PREFIX) get no history, since nothing could read it.
+"""
+import ast
+import asyncio
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from mymealplanner.state import (
+    HISTORY_SCHEMA_SQL,
+    RECIPE_HISTORY_TTL_SECONDS,
+    connect,
+    ensure_schema,
+    state_db_path,
+)
+
+# Two titles whose shingle sets have at least this Jaccard similarity are duplicates
+TITLE_THRESHOLD = 0.6
+# Titles at least this similar are duplicates if their ingredients also match
+PARTIAL_TITLE_THRESHOLD = 0.3
+INGREDIENT_THRESHOLD = 0.6
+
+# Recipes remembered per user, and how many of them go into the exclusion list
+HISTORY_LIMIT = 200
+EXCLUSION_LIMIT = 40
+# Users whose history the in-process store keeps before evicting the oldest
+MAX_USERS = 1000
+
+# Spare recipes RecipeSearchAgent is asked for (see its instruction), so
+# repeats can be dropped
+SPARE_RECIPES = 3
+MEALS_PER_DAY = 3
+
+# Prefix of the throwaway user ids given to requests without a client id
+ANONYMOUS_USER_PREFIX = "anon_"
+
+# Words that describe a recipe rather than identify the dish
+TITLE_STOPWORDS = frozenset("""
+a an and the with of in on for to from style best easy simple quick quickest
+healthy homemade classic perfect ultimate favorite favourite my our
+delicious tasty recipe recipes minute minutes min
+""".split())
+
+# Ingredients nearly every recipe uses; they say nothing about the dish
+PANTRY_STAPLES = frozenset("""
+salt pepper black water oil olive vegetable canola butter sugar flour garlic
+""".split())
+
+_DOMAIN_SUFFIX = re.compile(r'\s*\([^)]*\.[a-z]{2,}[^)]*\)\s*$', re.IGNORECASE)
+_WORD = re.compile(r'[a-z]+')
+_CODE_FENCE = re.compile(r'^\s*```[a-zA-Z]*\s*$', re.MULTILINE)
+_NUMBER_WORDS = {
+    "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7,
+    "eight": 8, "nine": 9, "ten": 10, "eleven": 11, "twelve": 12, "fourteen": 14,
+}
+_PERIOD = re.compile(
+    r'\b(\d+|' + "|".join(_NUMBER_WORDS) + r')\s*-?\s*(day|week)s?\b', re.IGNORECASE
+)
+_WEEK = re.compile(r'\bweeks?\b', re.IGNORECASE)
+_MEALS = {
+    "breakfast": re.compile(r'\bbreakfasts?\b', re.IGNORECASE),
+    "lunch": re.compile(r'\blunch(?:es)?\b', re.IGNORECASE),
+    "dinner": re.compile(r'\b(?:dinners?|suppers?)\b', re.IGNORECASE),
+}
+
+
+def _stem(word: str) -> str:
+    """Crude plural folding so 'pancakes' and 'pancake' match."""
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def _shingles(text: str, stopwords: frozenset) -> frozenset:
+    return frozenset(
+        _stem(word) for word in _WORD.findall(text.lower()) if word not in stopwords
+    )
+
+
+def _jaccard(a: frozenset, b: frozenset) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class RecipeFingerprint:
+    """Compact, comparable summary of one recipe."""
+
+    __slots__ = ("title", "key", "title_shingles", "ingredients")
+
+    def __init__(self, title: str, title_shingles: frozenset, ingredients: frozenset):
+        self.title = title
+        self.title_shingles = title_shingles
+        self.ingredients = ingredients
+        # Order-independent key used for storage and the exclusion list
+        self.key = " ".join(sorted(title_shingles))
+
+    def similar_to(self, other: "RecipeFingerprint") -> bool:
+        """Return True if the two recipes are near-duplicates."""
+        title_sim = _jaccard(self.title_shingles, other.title_shingles)
+        if title_sim >= TITLE_THRESHOLD:
+            return True
+        return (
+            title_sim >= PARTIAL_TITLE_THRESHOLD
+            and _jaccard(self.ingredients, other.ingredients) >= INGREDIENT_THRESHOLD
+        )
+
+
+def fingerprint_recipe(recipe: dict) -> RecipeFingerprint:
+    """Fingerprint a recipe dict as produced by RecipeSearchAgent."""
+    title = str(recipe.get("recipe_title") or recipe.get("title") or "")
+    bare_title = _DOMAIN_SUFFIX.sub("", title)
+
+    ingredients = recipe.get("ingredients") or {}
+    names = ingredients.keys() if isinstance(ingredients, dict) else ingredients
+    ingredient_shingles = set()
+    for name in names:
+        # Multi-word ingredients become one token ("chickpea", "red onion")
+        words = [_stem(w) for w in _WORD.findall(str(name).lower()) if w not in PANTRY_STAPLES]
+        if words:
+            ingredient_shingles.add(" ".join(words))
+
+    return RecipeFingerprint(
+        bare_title.strip(),
+        _shingles(bare_title, TITLE_STOPWORDS),
+        frozenset(ingredient_shingles),
+    )
+
+
+def parse_recipes(raw) -> list:
+    """Extract the list of recipe dicts from the search agent's output.
+
+    The model usually returns a JSON array, sometimes wrapped in a Markdown
+    code fence, preceded by prose that contains brackets of its own, or
+    written as a Python literal.
+
+    Returns:
+        A list of recipe dicts, or None if the output could not be parsed.
+    """
+    if isinstance(raw, list):
+        return [r for r in raw if isinstance(r, dict)]
+    if not isinstance(raw, str):
+        return None
+
+    text = _CODE_FENCE.sub("", raw)
+    decoder = json.JSONDecoder()
+    end = text.rfind("]")
+    start = text.find("[")
+    while start != -1:
+        try:
+            recipes, _ = decoder.raw_decode(text, start)
+        except ValueError:
+            # Not JSON here; maybe a Python literal running to the last bracket
+            try:
+                recipes = ast.literal_eval(text[start:end + 1])
+            except (ValueError, SyntaxError):
+                recipes = None
+        if isinstance(recipes, list) and any(isinstance(r, dict) for r in recipes):
+            return [r for r in recipes if isinstance(r, dict)]
+        start = text.find("[", start + 1)
+    return None
+
+
+def meals_needed(prompt: str):
+    """Estimate how many recipes the plan needs from the user's prompt.
+
+    The number of days comes from phrases like "2-day", "five days",
+    "2 weeks" or "a week". If the prompt names only some meals ("a week of
+    dinners"), only those are counted; otherwise MEALS_PER_DAY.
+
+    Returns:
+        Days times meals per day, or None if the prompt gives no duration.
+    """
+    if not prompt:
+        return None
+    match = _PERIOD.search(prompt)
+    if match:
+        count = match.group(1).lower()
+        days = int(count) if count.isdigit() else _NUMBER_WORDS[count]
+        if match.group(2).lower() == "week":
+            days *= 7
+    elif _WEEK.search(prompt):
+        days = 7
+    else:
+        return None
+
+    meals = sum(1 for pattern in _MEALS.values() if pattern.search(prompt))
+    return days * (meals or MEALS_PER_DAY)
+
+
+def filter_near_duplicates(recipes: list, history: list, needed: int = None) -> tuple:
+    """Pick the recipes for the plan, avoiding near-duplicates.
+
+    Duplicates within the list are always dropped. Recipes that do not
+    repeat the history are preferred; repeats are only kept, earliest
+    first, when the plan could not be filled otherwise. The result is cut
+    to the number of recipes the plan needs, so spare recipes are not
+    passed on (or recorded in the history).
+
+    Args:
+        recipes: Recipe dicts in the search agent's order.
+        history: RecipeFingerprints of the user's recent recipes.
+        needed: Recipes the plan needs, if known. Otherwise every fresh
+            recipe is kept, topped up with repeats to all unique recipes
+            except the SPARE_RECIPES the search agent was asked for.
+
+    Returns:
+        A (kept_recipes, kept_fingerprints, dropped_titles) tuple, with the
+        kept recipes in their original order.
+    """
+    unique = []
+    for recipe in recipes:
+        fingerprint = fingerprint_recipe(recipe)
+        if not fingerprint.title_shingles:
+            continue
+        if any(fingerprint.similar_to(seen) for _, seen in unique):
+            continue
+        unique.append((recipe, fingerprint))
+
+    fresh, repeats = [], []
+    for index, (_, fingerprint) in enumerate(unique):
+        if any(fingerprint.similar_to(past) for past in history):
+            repeats.append(index)
+        else:
+            fresh.append(index)
+
+    if needed is None:
+        needed = max(len(fresh), len(unique) - SPARE_RECIPES)
+    needed = max(1, min(needed, len(unique)))
+    kept = [unique[index] for index in sorted((fresh + repeats)[:needed])]
+
+    kept_ids = {id(recipe) for recipe, _ in kept}
+    dropped = [
+        str(recipe.get("recipe_title") or recipe.get("title") or "")
+        for recipe in recipes if id(recipe) not in kept_ids
+    ]
+    return [r for r, _ in kept], [f for _, f in kept], dropped
+
+
+def exclusion_list(history: list, limit: int = EXCLUSION_LIMIT) -> str:
+    """Compact, prompt-ready list of the user's most recent dish names."""
+    seen = set()
+    titles = []
+    for fingerprint in history:
+        if fingerprint.key in seen:
+            continue
+        seen.add(fingerprint.key)
+        titles.append(fingerprint.title)
+        if len(titles) >= limit:
+            break
+    return "; ".join(titles) if titles else "none"
+
+
+class InMemoryRecipeHistory:
+    """Per-process recipe history. Lost on restart and not shared by workers."""
+
+    def __init__(self, limit: int = HISTORY_LIMIT, max_users: int = MAX_USERS):
+        self._limit = limit
+        self._max_users = max_users
+        self._lock = threading.Lock()
+        self._recipes = OrderedDict()
+
+    async def recent(self, app_name: str, user_id: str) -> list:
+        """Return the user's fingerprints, most recent first."""
+        with self._lock:
+            recipes = self._recipes.get((app_name, user_id), OrderedDict())
+            return list(reversed(recipes.values()))
+
+    async def add(self, app_name: str, user_id: str, fingerprints: list) -> None:
+        with self._lock:
+            key = (app_name, user_id)
+            recipes = self._recipes.pop(key, None) or OrderedDict()
+            self._recipes[key] = recipes
+            while len(self._recipes) > self._max_users:
+                self._recipes.popitem(last=False)
+            for fingerprint in fingerprints:
+                recipes.pop(fingerprint.key, None)
+                recipes[fingerprint.key] = fingerprint
+            while len(recipes) > self._limit:
+                recipes.popitem(last=False)
+
+
+class SqliteRecipeHistory:
+    """Recipe history in the shared state database, visible to every worker."""
+
+    def __init__(self, db_path: str, limit: int = HISTORY_LIMIT):
+        self._db_path = db_path
+        self._limit = limit
+        ensure_schema(db_path, HISTORY_SCHEMA_SQL)
+
+    async def recent(self, app_name: str, user_id: str) -> list:
+        """Return the user's fingerprints, most recent first."""
+        rows = await asyncio.to_thread(self._select, app_name, user_id)
+        return [
+            RecipeFingerprint(
+                title,
+                frozenset(title_key.split()),
+                frozenset(i for i in ingredients.split("|") if i),
+            )
+            for title_key, title, ingredients in rows
+        ]
+
+    def _select(self, app_name: str, user_id: str) -> list:
+        conn = connect(self._db_path)
+        try:
+            return conn.execute(
+                "SELECT title_key, title, ingredients FROM recipe_history "
+                "WHERE app_name = ? AND user_id = ? AND created_at >= ? "
+                "ORDER BY created_at DESC LIMIT ?",
+                (app_name, user_id, time.time() - RECIPE_HISTORY_TTL_SECONDS, self._limit),
+            ).fetchall()
+        finally:
+            conn.close()
+
+    async def add(self, app_name: str, user_id: str, fingerprints: list) -> None:
+        if fingerprints:
+            await asyncio.to_thread(self._insert, app_name, user_id, fingerprints)
+
+    def _insert(self, app_name: str, user_id: str, fingerprints: list) -> None:
+        now = time.time()
+        conn = connect(self._db_path)
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO recipe_history "
+                    "(app_name, user_id, title_key, title, ingredients, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [
+                        (app_name, user_id, f.key, f.title, "|".join(sorted(f.ingredients)), now)
+                        for f in fingerprints
+                    ],
+                )
+                conn.execute(
+                    "DELETE FROM recipe_history WHERE app_name = ? AND user_id = ? "
+                    "AND title_key NOT IN (SELECT title_key FROM recipe_history "
+                    "WHERE app_name = ? AND user_id = ? ORDER BY created_at DESC LIMIT ?)",
+                    (app_name, user_id, app_name, user_id, self._limit),
+                )
+        finally:
+            conn.close()
+
+
+_history = None
+_history_lock = threading.Lock()
+
+
+def get_recipe_history():
+    """Return the process-wide recipe history for the configured backend."""
+    global _history
+    with _history_lock:
+        if _history is None:
+            db_path = state_db_path()
+            _history = SqliteRecipeHistory(db_path) if db_path else InMemoryRecipeHistory()
+        return _history
@@ -0,0 +1,179 @@
+"""
+Structured, non-blocking request logging.
+
+Log records are put on a queue by the request thread and written to stdout
+as one JSON object per line by a background listener thread, in the format
+Cloud Logging understands (severity, message, trace). Every record carries
+the trace id of the request that produced it.
+
+Large payloads (raw summaries, parsed plans, model responses) go through
+log_payload, which only emits them at DEBUG level or for the sampled
+fraction of requests, and serializes them off the request thread.
+
+Environment variables:
+    MEALPLANNER_LOG_LEVEL: Minimum level to log (default INFO, also used
+        when the value is not a valid level name).
+    MEALPLANNER_LOG_PAYLOAD_SAMPLE_RATE: Fraction of requests, 0.0-1.0,
+        whose payloads are logged at INFO (default 0.0).
+"""
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import uuid
+from datetime import datetime, timezone
+from typing import Optional
+
+LOGGER_NAME = "mymealplanner"
+
+trace_id_var = contextvars.ContextVar("trace_id", default=None)
+# True when trace_id came from Cloud Run's X-Cloud-Trace-Context header
+cloud_trace_var = contextvars.ContextVar("cloud_trace", default=False)
+payload_sampled_var = contextvars.ContextVar("payload_sampled", default=False)
+
+_listener = None
+_exception_formatter = logging.Formatter()
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as a single-line JSON object for Cloud Logging."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "severity": record.levelname,
+            "message": record.getMessage(),
+            "time": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "logger": record.name,
+        }
+        trace_id = getattr(record, "trace_id", None)
+        if trace_id:
+            entry["trace_id"] = trace_id
+            project = os.environ.get("GOOGLE_CLOUD_PROJECT")
+            # Only real Cloud Trace ids may go in the trace field; request ids
+            # and generated ids would link to traces that do not exist
+            if project and getattr(record, "cloud_trace", False):
+                entry["logging.googleapis.com/trace"] = f"projects/{project}/traces/{trace_id}"
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class _ContextQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that captures the trace id in the calling thread.
+
+    Unlike the stock QueueHandler it does not pre-format the message, so the
+    JSON formatting (and payload serialization) happens on the listener
+    thread instead of the request thread.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        record.trace_id = trace_id_var.get()
+        record.cloud_trace = cloud_trace_var.get()
+        return record
+
+
+def setup_logging() -> None:
+    """Route the mymealplanner loggers through the background JSON writer.
+
+    Safe to call more than once; only the first call installs the handler.
+    Call it after gunicorn forks (i.e. at app import without --preload) so
+    each worker runs its own listener thread.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter())
+    _listener = logging.handlers.QueueListener(
+        log_queue, stream_handler, respect_handler_level=True
+    )
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    level = logging.getLevelName(os.environ.get("MEALPLANNER_LOG_LEVEL", "INFO").upper())
+    if not isinstance(level, int):
+        level = logging.INFO
+
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(level)
+    logger.addHandler(_ContextQueueHandler(log_queue))
+    logger.propagate = False
+
+
+def begin_request(headers) -> tuple:
+    """Bind a trace id and payload sampling decision to the current request.
+
+    Reuses the trace id from Cloud Run's X-Cloud-Trace-Context header or a
+    client supplied X-Request-ID, so logs line up with the platform's request
+    logs, and generates one otherwise.
+
+    Returns:
+        A (trace_id, token) tuple. Pass the token to end_request when the
+        request is finished.
+    """
+    cloud_trace = headers.get("X-Cloud-Trace-Context", "").split("/", 1)[0]
+    trace_id = cloud_trace or headers.get("X-Request-ID") or uuid.uuid4().hex
+
+    try:
+        sample_rate = float(os.environ.get("MEALPLANNER_LOG_PAYLOAD_SAMPLE_RATE", "0"))
+    except ValueError:
+        sample_rate = 0.0
+
+    token = (
+        trace_id_var.set(trace_id),
+        cloud_trace_var.set(bool(cloud_trace)),
+        payload_sampled_var.set(random.random() < sample_rate),
+    )
+    return trace_id, token
+
+
+def end_request(token) -> None:
+    """Unbind the request's trace id so later logs on this thread don't carry it."""
+    if token is None:
+        return
+    trace_token, cloud_token, sampled_token = token
+    payload_sampled_var.reset(sampled_token)
+    cloud_trace_var.reset(cloud_token)
+    trace_id_var.reset(trace_token)
+
+
+def current_trace_id() -> Optional[str]:
+    """Return the trace id bound to the current request, if any."""
+    return trace_id_var.get()
+
+
+def log_payload(logger: logging.Logger, label: str, payload, **fields) -> None:
+    """Log a large payload only when it is going to be read.
+
+    Payloads are logged at INFO for sampled requests and at DEBUG otherwise,
+    so at the default INFO level unsampled requests skip them entirely. The
+    payload is serialized by the background writer, not the caller.
+
+    Args:
+        logger: The logger to use.
+        label: Short message describing the payload.
+        payload: Any JSON-serializable value. Do not mutate it after logging.
+        **fields: Extra structured fields for the log entry.
+    """
+    level = logging.INFO if payload_sampled_var.get() else logging.DEBUG
+    if not logger.isEnabledFor(level):
+        return
+    fields["payload"] = payload
+    logger.log(level, label, extra={"fields": fields})
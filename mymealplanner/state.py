@@ -0,0 +1,329 @@
+"""
+Shared state backends so several gunicorn workers can serve the same instance.
+
+The InMemory* services keep everything inside one process, which forces
+--workers 1. When MEALPLANNER_STATE_DB points at a SQLite file, sessions and
+memory are stored there instead. The database runs in WAL mode, so readers
+never block the single writer and every worker process sees the same data.
+
+Nothing in the database lives forever: sessions are deleted once their
+response is built (stale ones are swept after SESSION_TTL_SECONDS), memory
+is capped per user and expires after MEMORY_TTL_SECONDS, and recipe history
+(see diversity.py) expires after RECIPE_HISTORY_TTL_SECONDS.
+"""
+import asyncio
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+import aiosqlite
+from google.adk.memory import BaseMemoryService, InMemoryMemoryService
+from google.adk.memory.base_memory_service import SearchMemoryResponse
+from google.adk.memory.memory_entry import MemoryEntry
+from google.adk.sessions import InMemorySessionService
+from google.adk.sessions.sqlite_session_service import (
+    CREATE_SCHEMA_SQL,
+    PRAGMA_FOREIGN_KEYS,
+    SqliteSessionService,
+)
+from google.genai import types
+
+logger = logging.getLogger(__name__)
+
+STATE_DB_ENV = "MEALPLANNER_STATE_DB"
+
+# How long a connection waits for another process to release the write lock
+BUSY_TIMEOUT_SECONDS = 30
+
+# Sessions are deleted after each request; this only sweeps ones left behind
+# by failed requests
+SESSION_TTL_SECONDS = 60 * 60
+MEMORY_TTL_SECONDS = 7 * 24 * 60 * 60
+MEMORY_EVENTS_PER_USER = 200
+RECIPE_HISTORY_TTL_SECONDS = 30 * 24 * 60 * 60
+# Most recent matching memories returned to preload_memory
+MEMORY_SEARCH_LIMIT = 20
+PRUNE_INTERVAL_SECONDS = 5 * 60
+
+# Words too common to tell one memory from another
+MEMORY_STOPWORDS = frozenset("""
+the and for with you can help come are that this from have what your our
+""".split())
+
+_schema_lock = threading.Lock()
+_initialized_paths = set()
+_wal_paths = set()
+_prune_lock = threading.Lock()
+_last_prune = {}
+
+MEMORY_SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS memory_events (
+    app_name TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    event_id TEXT NOT NULL,
+    author TEXT,
+    timestamp REAL,
+    content TEXT NOT NULL,
+    text TEXT NOT NULL,
+    PRIMARY KEY (app_name, user_id, session_id, event_id)
+);
+CREATE INDEX IF NOT EXISTS idx_memory_events_user
+    ON memory_events (app_name, user_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_memory_events_timestamp
+    ON memory_events (timestamp);
+"""
+
+HISTORY_SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS recipe_history (
+    app_name TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    title_key TEXT NOT NULL,
+    title TEXT NOT NULL,
+    ingredients TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (app_name, user_id, title_key)
+);
+CREATE INDEX IF NOT EXISTS idx_recipe_history_recent
+    ON recipe_history (app_name, user_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_recipe_history_created
+    ON recipe_history (created_at);
+"""
+
+
+def state_db_path() -> str:
+    """Return the configured shared state database path, or '' if unset."""
+    return os.environ.get(STATE_DB_ENV, "")
+
+
+def enable_wal(db_path: str) -> None:
+    """Switch the database file to WAL mode, once per process.
+
+    journal_mode=WAL is stored in the database file, so every later
+    connection (ours and ADK's) uses it without setting it again.
+    """
+    with _schema_lock:
+        if db_path in _wal_paths:
+            return
+        conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT_SECONDS)
+        try:
+            mode = conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+        finally:
+            conn.close()
+        if mode.lower() != "wal":
+            logger.warning("Could not enable WAL mode for %s (journal_mode=%s)", db_path, mode)
+        _wal_paths.add(db_path)
+
+
+def connect(db_path: str) -> sqlite3.Connection:
+    """Open a connection to the shared state database.
+
+    synchronous=NORMAL is safe in WAL mode and avoids an fsync per commit.
+    """
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT_SECONDS)
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(PRAGMA_FOREIGN_KEYS)
+    return conn
+
+
+def ensure_schema(db_path: str, schema_sql: str) -> None:
+    """Create tables once per process for the given database and schema."""
+    enable_wal(db_path)
+    key = (db_path, schema_sql)
+    with _schema_lock:
+        if key in _initialized_paths:
+            return
+        conn = connect(db_path)
+        try:
+            conn.executescript(schema_sql)
+            conn.commit()
+        finally:
+            conn.close()
+        _initialized_paths.add(key)
+
+
+def prune_state(db_path: str) -> None:
+    """Delete stale sessions, expired memory and expired recipe history.
+
+    Runs at most every PRUNE_INTERVAL_SECONDS per process.
+    """
+    now = time.time()
+    with _prune_lock:
+        if now - _last_prune.get(db_path, 0) < PRUNE_INTERVAL_SECONDS:
+            return
+        _last_prune[db_path] = now
+
+    conn = connect(db_path)
+    try:
+        with conn:
+            # Events go with their session through ON DELETE CASCADE
+            sessions = conn.execute(
+                "DELETE FROM sessions WHERE update_time < ?", (now - SESSION_TTL_SECONDS,)
+            ).rowcount
+            memories = conn.execute(
+                "DELETE FROM memory_events WHERE timestamp < ?", (now - MEMORY_TTL_SECONDS,)
+            ).rowcount
+            recipes = conn.execute(
+                "DELETE FROM recipe_history WHERE created_at < ?",
+                (now - RECIPE_HISTORY_TTL_SECONDS,),
+            ).rowcount
+    finally:
+        conn.close()
+    if sessions or memories or recipes:
+        logger.info("Pruned shared state", extra={"fields": {
+            "sessions": sessions,
+            "memory_events": memories,
+            "recipe_history": recipes,
+        }})
+
+
+def _extract_words_lower(text: str) -> set:
+    """Extracts distinctive words from a string and converts them to lowercase."""
+    return set(
+        word for word in (w.lower() for w in re.findall(r'[A-Za-z]+', text))
+        if len(word) >= 3 and word not in MEMORY_STOPWORDS
+    )
+
+
+class SharedSqliteSessionService(SqliteSessionService):
+    """ADK's SqliteSessionService with connections tuned for several processes.
+
+    The stock service opens connections with sqlite3's default 5 second busy
+    timeout and re-runs its CREATE TABLE script on every connection. Here the
+    schema is created once per process and every connection waits up to
+    BUSY_TIMEOUT_SECONDS for other workers' writes.
+    """
+
+    @asynccontextmanager
+    async def _get_db_connection(self):
+        ensure_schema(self._db_path, CREATE_SCHEMA_SQL)
+        async with aiosqlite.connect(self._db_path, timeout=BUSY_TIMEOUT_SECONDS) as db:
+            db.row_factory = aiosqlite.Row
+            await db.execute(PRAGMA_FOREIGN_KEYS)
+            await db.execute("PRAGMA synchronous=NORMAL")
+            yield db
+
+
+class SqliteMemoryService(BaseMemoryService):
+    """Memory service backed by a SQLite file shared between processes.
+
+    Uses the same keyword matching as InMemoryMemoryService, ignoring short
+    and filler words, and returns at most MEMORY_SEARCH_LIMIT of the most
+    recent matches. Events are keyed by id, so re-adding a session after
+    every agent turn only inserts the new events. Only the newest
+    MEMORY_EVENTS_PER_USER events are kept per user.
+    """
+
+    def __init__(self, db_path: str):
+        self._db_path = db_path
+        ensure_schema(db_path, MEMORY_SCHEMA_SQL)
+
+    async def add_session_to_memory(self, session) -> None:
+        rows = []
+        for event in session.events:
+            if not event.content or not event.content.parts:
+                continue
+            text = ' '.join(part.text for part in event.content.parts if part.text)
+            rows.append((
+                session.app_name,
+                session.user_id,
+                session.id,
+                event.id,
+                event.author,
+                event.timestamp,
+                event.content.model_dump_json(exclude_none=True),
+                text,
+            ))
+        if rows:
+            await asyncio.to_thread(self._insert_events, rows)
+
+    def _insert_events(self, rows: list) -> None:
+        conn = connect(self._db_path)
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO memory_events "
+                    "(app_name, user_id, session_id, event_id, author, timestamp, content, text) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+                app_name, user_id = rows[0][0], rows[0][1]
+                conn.execute(
+                    "DELETE FROM memory_events WHERE app_name = ? AND user_id = ? "
+                    "AND rowid NOT IN (SELECT rowid FROM memory_events "
+                    "WHERE app_name = ? AND user_id = ? ORDER BY timestamp DESC LIMIT ?)",
+                    (app_name, user_id, app_name, user_id, MEMORY_EVENTS_PER_USER),
+                )
+        finally:
+            conn.close()
+
+    async def search_memory(
+        self, *, app_name: str, user_id: str, query: str
+    ) -> SearchMemoryResponse:
+        rows = await asyncio.to_thread(self._select_events, app_name, user_id)
+
+        words_in_query = _extract_words_lower(query)
+        response = SearchMemoryResponse()
+        # Rows are newest first; stop once enough memories are found
+        for author, timestamp, content, text in rows:
+            if len(response.memories) >= MEMORY_SEARCH_LIMIT:
+                break
+            words_in_event = _extract_words_lower(text)
+            if not words_in_event:
+                continue
+            if any(query_word in words_in_event for query_word in words_in_query):
+                response.memories.append(
+                    MemoryEntry(
+                        content=types.Content.model_validate_json(content),
+                        author=author,
+                        timestamp=datetime.fromtimestamp(timestamp).isoformat() if timestamp else None,
+                    )
+                )
+        return response
+
+    def _select_events(self, app_name: str, user_id: str) -> list:
+        conn = connect(self._db_path)
+        try:
+            return conn.execute(
+                "SELECT author, timestamp, content, text FROM memory_events "
+                "WHERE app_name = ? AND user_id = ? AND timestamp >= ? "
+                "ORDER BY timestamp DESC",
+                (app_name, user_id, time.time() - MEMORY_TTL_SECONDS),
+            ).fetchall()
+        finally:
+            conn.close()
+
+
+def create_state_services(shared_memory: bool = True) -> tuple:
+    """Create the session and memory services for one request.
+
+    With MEALPLANNER_STATE_DB set, both services are backed by that SQLite
+    file and shared by every worker process. Otherwise they are the
+    per-process in-memory services, which only work with a single worker.
+
+    The service objects only hold the database path and open a connection
+    per operation, so creating them per request is cheap and keeps them
+    independent of the thread and event loop serving the request.
+
+    Args:
+        shared_memory: Whether the caller has a stable per-client user id.
+            Without one, memory is kept for this request only, as nothing
+            could ever read it back.
+
+    Returns:
+        A (session_service, memory_service) tuple.
+    """
+    db_path = state_db_path()
+    if not db_path:
+        return InMemorySessionService(), InMemoryMemoryService()
+
+    ensure_schema(db_path, CREATE_SCHEMA_SQL)
+    ensure_schema(db_path, MEMORY_SCHEMA_SQL)
+    ensure_schema(db_path, HISTORY_SCHEMA_SQL)
+    prune_state(db_path)
+    memory_service = SqliteMemoryService(db_path) if shared_memory else InMemoryMemoryService()
+    return SharedSqliteSessionService(db_path), memory_service
@@ -0,0 +1,99 @@
+"""
+Stubbed model for load testing the API without calling Vertex AI.
+
+Enable it by starting the server with MEALPLANNER_STUB_MODEL=1. The agents
+then use StubLlm instead of Gemini, and everything else runs for real: the
+Runner, session events, memory writes and callbacks, parsing and JSON
+serialization. Only the model round trip is replaced with a configurable
+delay and a canned response.
+"""
+import asyncio
+import json
+import os
+from typing import AsyncGenerator
+from google.adk.models import BaseLlm
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+from google.genai import types
+
+STUB_RECIPES = json.dumps([
+    {"recipe_title": "Fluffy Buttermilk Pancakes (simplyrecipes.com)",
+     "ingredients": {"buttermilk": "2 cups", "all-purpose flour": "2 cups"}},
+    {"recipe_title": "Mediterranean Chickpea Salad (seriouseats.com)",
+     "ingredients": {"chickpeas": "1 can", "cucumber": "1"}},
+    {"recipe_title": "Chicken Tikka Masala (allrecipes.com)",
+     "ingredients": {"chicken thighs": "1.5 lb", "garam masala": "2 tsp"}},
+    {"recipe_title": "Overnight Oats (minimalistbaker.com)",
+     "ingredients": {"rolled oats": "1 cup", "almond milk": "1 cup"}},
+    {"recipe_title": "Black Bean Tacos (budgetbytes.com)",
+     "ingredients": {"black beans": "1 can", "corn tortillas": "8"}},
+    {"recipe_title": "Miso Glazed Salmon (bonappetit.com)",
+     "ingredients": {"salmon fillets": "2", "white miso": "2 tbsp"}},
+], indent=2)
+
+STUB_SUMMARY = """DAY #1 (Jan-01, Thursday):
+
+BREAKFAST: [Fluffy Buttermilk Pancakes (simplyrecipes.com)](https://www.google.com/search?q=Fluffy+Buttermilk+Pancakes+simplyrecipes.com+recipe)
+LUNCH: [Mediterranean Chickpea Salad (seriouseats.com)](https://www.google.com/search?q=Mediterranean+Chickpea+Salad+seriouseats.com+recipe)
+DINNER: [Chicken Tikka Masala (allrecipes.com)](https://www.google.com/search?q=Chicken+Tikka+Masala+allrecipes.com+recipe)
+
+DAY #2 (Jan-02, Friday):
+
+BREAKFAST: [Overnight Oats (minimalistbaker.com)](https://www.google.com/search?q=Overnight+Oats+minimalistbaker.com+recipe)
+LUNCH: [Black Bean Tacos (budgetbytes.com)](https://www.google.com/search?q=Black+Bean+Tacos+budgetbytes.com+recipe)
+DINNER: [Miso Glazed Salmon (bonappetit.com)](https://www.google.com/search?q=Miso+Glazed+Salmon+bonappetit.com+recipe)
+
+DAY #1 INGREDIENTS:
+- buttermilk (2 cups)
+- all-purpose flour (2 cups)
+- chickpeas (1 can)
+- cucumber (1)
+- chicken thighs (1.5 lb)
+- garam masala (2 tsp)
+
+DAY #2 INGREDIENTS:
+- rolled oats (1 cup)
+- almond milk (1 cup)
+- black beans (1 can)
+- corn tortillas (8)
+- salmon fillets (2)
+- white miso (2 tbsp)
+
+RECIPE LINKS:
+
+DAY #1:
+- [Fluffy Buttermilk Pancakes (simplyrecipes.com)](https://www.google.com/search?q=Fluffy+Buttermilk+Pancakes+simplyrecipes.com+recipe)
+- [Mediterranean Chickpea Salad (seriouseats.com)](https://www.google.com/search?q=Mediterranean+Chickpea+Salad+seriouseats.com+recipe)
+- [Chicken Tikka Masala (allrecipes.com)](https://www.google.com/search?q=Chicken+Tikka+Masala+allrecipes.com+recipe)
+
+DAY #2:
+- [Overnight Oats (minimalistbaker.com)](https://www.google.com/search?q=Overnight+Oats+minimalistbaker.com+recipe)
+- [Black Bean Tacos (budgetbytes.com)](https://www.google.com/search?q=Black+Bean+Tacos+budgetbytes.com+recipe)
+- [Miso Glazed Salmon (bonappetit.com)](https://www.google.com/search?q=Miso+Glazed+Salmon+bonappetit.com+recipe)
+"""
+
+
+def stub_model_enabled() -> bool:
+    """Return True when the agents should use the stubbed model."""
+    return os.environ.get("MEALPLANNER_STUB_MODEL", "").lower() in ("1", "true", "yes")
+
+
+class StubLlm(BaseLlm):
+    """Model that waits MEALPLANNER_STUB_LATENCY seconds and returns a canned reply."""
+
+    response_text: str
+
+    @classmethod
+    def supported_models(cls) -> list[str]:
+        return [r"stub-.*"]
+
+    async def generate_content_async(
+        self, llm_request: LlmRequest, stream: bool = False
+    ) -> AsyncGenerator[LlmResponse, None]:
+        # Simulate the time spent waiting on the model
+        delay = float(os.environ.get("MEALPLANNER_STUB_LATENCY", "0.5"))
+        if delay > 0:
+            await asyncio.sleep(delay)
+        yield LlmResponse(
+            content=types.Content(role="model", parts=[types.Part(text=self.response_text)])
+        )
@@ -21,6 +21,20 @@ function App() {
     };
     const API_URL = getApiUrl();
 
+    // Anonymous id for this browser, so the backend can keep memory and
+    // recipe history per client instead of sharing it between everyone
+    const getClientId = () => {
+        const key = 'mymealplanner_client_id';
+        let clientId = localStorage.getItem(key);
+        if (!clientId) {
+            clientId = (window.crypto && crypto.randomUUID)
+                ? crypto.randomUUID().replace(/-/g, '')
+                : Array.from({ length: 32 }, () => Math.floor(Math.random() * 16).toString(16)).join('');
+            localStorage.setItem(key, clientId);
+        }
+        return clientId;
+    };
+
     const handlePlan = async () => {
         setLoading(true);
         setError(null);
@@ -40,7 +54,7 @@ function App() {
                 headers: {
                     'Content-Type': 'application/json',
                 },
-                body: JSON.stringify({ prompt }),
+                body: JSON.stringify({ prompt, client_id: getClientId() }),
             });
 
             clearInterval(progressInterval);